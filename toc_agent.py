@@ -7,11 +7,16 @@ version: 9.0.0 (Instant Intent Reflex)
 """
 
 import os
+import sys
 import requests
 import json
 import datetime
 import time
 import re
+import random
+import queue
+import threading
+import collections
 import concurrent.futures
 from typing import List, Union, Generator, Iterator
 from pydantic import BaseModel
@@ -42,6 +47,307 @@ class KeyManager:
         }
 
 
+# ==========================================
+# 🔬 效能剖析 (由 Valves 開關，按比例取樣)
+# ==========================================
+class PipeProfiler:
+    """
+    取樣式剖析器：背景執行緒定期讀取 sys._current_frames()，
+    只記錄正在推進 pipe 產生器的執行緒與規劃器的 worker 執行緒。
+    結束時輸出 collapsed-stack (.folded，可直接給 flamegraph.pl / speedscope) 與單次摘要 (.json)。
+    """
+
+    FILE_PREFIX = "toc_profile_"
+    _local = threading.local()
+
+    def __init__(
+        self,
+        out_dir: str,
+        interval_ms: float = 5.0,
+        max_bytes: int = 50 * 1024 * 1024,
+        tag: str = "",
+    ):
+        self.out_dir = out_dir
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.max_bytes = max_bytes
+        self.tag = tag
+        self.threads = {}  # thread ident -> "pipe" / "worker"
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.chunks = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = 0.0
+
+    @classmethod
+    def current(cls):
+        """目前執行緒正在推進的剖析 session (沒有則為 None)"""
+        return getattr(cls._local, "session", None)
+
+    @staticmethod
+    def bind(fn):
+        """
+        在 pipe 執行緒呼叫：包住要丟給 worker 的函式，
+        只在函式執行期間把該 worker 納入取樣 (閒置或被重用的執行緒不算)
+        """
+        session = PipeProfiler.current()
+        if session is None:
+            return fn
+
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            with session._lock:
+                session.threads[ident] = "worker"
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with session._lock:
+                    session.threads.pop(ident, None)
+
+        return run
+
+    def profile(self, gen: Generator) -> Generator[str, None, None]:
+        """包住 pipe 產生器，剖析範圍涵蓋它的完整生命週期"""
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(
+            target=self._sample_loop, name="toc_profiler", daemon=True
+        )
+        self._sampler.start()
+        try:
+            while True:
+                # 產生器每次可能由不同執行緒推進，只在 next() 期間取樣該執行緒
+                ident = threading.get_ident()
+                with self._lock:
+                    self.threads[ident] = "pipe"
+                PipeProfiler._local.session = self
+                try:
+                    chunk = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    PipeProfiler._local.session = None
+                    with self._lock:
+                        self.threads.pop(ident, None)
+                self.chunks += 1
+                yield chunk
+        finally:
+            gen.close()
+            self._finish()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                targets = list(self.threads.items())
+            for ident, label in targets:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self._collapse(label, frame)] += 1
+                    self.samples += 1
+
+    @staticmethod
+    def _collapse(label: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        names.append(label)
+        return ";".join(reversed(names))
+
+    def _finish(self):
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join(timeout=1.0)
+        wall_ms = (time.perf_counter() - self._started) * 1000
+
+        # 每個 stack 的最末端函式 = self time
+        leaf = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+
+        summary = {
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "tag": self.tag,
+            "wall_ms": round(wall_ms, 1),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "chunks": self.chunks,
+            "top_self": [
+                {"frame": name, "samples": count}
+                for name, count in leaf.most_common(15)
+            ],
+        }
+
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            base = os.path.join(
+                self.out_dir, f"{self.FILE_PREFIX}{stamp}_{os.getpid()}"
+            )
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            self._rotate()
+        except Exception:
+            # 剖析失敗不能影響回應
+            pass
+
+    def _rotate(self):
+        """目錄總大小超過 max_bytes 時，從最舊的檔案開始刪"""
+        files = []
+        for name in os.listdir(self.out_dir):
+            if name.startswith(self.FILE_PREFIX):
+                path = os.path.join(self.out_dir, name)
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# ==========================================
+# 📦 輸出合併 (把細碎片段合成 frame)
+# ==========================================
+class FrameCoalescer:
+    """
+    把 pipe 產生器吐出的細碎片段 (LLM token、心跳 " ."、狀態行) 合併成較大的 frame。
+    上游放在背景執行緒推進，即使卡在阻塞的 API 呼叫，已緩衝的內容也會依時間送出。
+    - 第一個片段立即送出 (TTFB 不變)
+    - 累積超過 max_bytes 或最舊片段等待超過 max_latency_ms 就送出
+    - 純心跳片段 (只有空白與 ".") 改用較長的 heartbeat_latency_ms，讓多個心跳共用一個 frame
+    - 段落邊界 (Markdown 標題之前、空行之後) 立即切 frame
+    """
+
+    _DONE = object()
+    _totals = {"responses": 0, "fragments": 0, "frames": 0}
+    _totals_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_bytes: int = 512,
+        max_latency_ms: float = 100.0,
+        heartbeat_latency_ms: float = 2000.0,
+        log_stats=False,
+    ):
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency_ms / 1000.0
+        self.heartbeat_latency = heartbeat_latency_ms / 1000.0
+        self.log_stats = log_stats
+        self.fragments = 0
+        self.frames = 0
+        self.bytes = 0
+
+    @classmethod
+    def totals(cls) -> dict:
+        """所有回應累計的 frame 統計"""
+        with cls._totals_lock:
+            totals = dict(cls._totals)
+        responses = totals["responses"]
+        totals["frames_per_response"] = (
+            round(totals["frames"] / responses, 2) if responses else 0.0
+        )
+        return totals
+
+    def coalesce(self, gen: Generator) -> Generator[str, None, None]:
+        q = queue.Queue()
+        stop = threading.Event()
+
+        def pump():
+            try:
+                for fragment in gen:
+                    q.put(fragment)
+                    if stop.is_set():
+                        break
+            except Exception as e:
+                q.put(e)
+            finally:
+                gen.close()
+                q.put(FrameCoalescer._DONE)
+
+        threading.Thread(target=pump, name="toc_coalesce", daemon=True).start()
+
+        started = time.perf_counter()
+        buf = []
+        size = 0
+        deadline = 0.0
+        error = None
+        try:
+            while True:
+                timeout = max(deadline - time.monotonic(), 0) if buf else None
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    yield self._flush(buf)
+                    buf, size = [], 0
+                    continue
+
+                if item is FrameCoalescer._DONE:
+                    break
+                if isinstance(item, Exception):
+                    error = item
+                    break
+                if not item:
+                    continue
+
+                self.fragments += 1
+                # 標題開新段落：先把前一段送出
+                if buf and item.lstrip("\n").startswith("#"):
+                    yield self._flush(buf)
+                    buf, size = [], 0
+
+                # 心跳只是讓使用者知道還活著，可以等久一點；一有實際內容就改回短期限
+                is_heartbeat = not item.strip(" .\n\t")
+                latency = self.heartbeat_latency if is_heartbeat else self.max_latency
+                due = time.monotonic() + latency
+                deadline = min(deadline, due) if buf else due
+                buf.append(item)
+                size += len(item.encode("utf-8"))
+
+                if self.frames == 0 or size >= self.max_bytes or item.endswith("\n\n"):
+                    yield self._flush(buf)
+                    buf, size = [], 0
+
+            if buf:
+                yield self._flush(buf)
+            if error is not None:
+                raise error
+        finally:
+            stop.set()
+            self._record(time.perf_counter() - started)
+
+    def _flush(self, buf: list) -> str:
+        frame = "".join(buf)
+        self.frames += 1
+        self.bytes += len(frame.encode("utf-8"))
+        return frame
+
+    def _record(self, elapsed: float):
+        with FrameCoalescer._totals_lock:
+            FrameCoalescer._totals["responses"] += 1
+            FrameCoalescer._totals["fragments"] += self.fragments
+            FrameCoalescer._totals["frames"] += self.frames
+        if self.log_stats:
+            totals = FrameCoalescer.totals()
+            print(
+                f"[toc_agent] frames: {self.frames} / fragments: {self.fragments} "
+                f"({self.bytes} bytes, {elapsed * 1000:.0f} ms) | "
+                f"avg frames/response: {totals['frames_per_response']}"
+            )
+
+
 # ==========================================
 # 🧠 記憶系統
 # ==========================================
@@ -100,6 +406,435 @@ class ZoneMemory:
             yield from Tools._call_smart(prompt)
 
 
+# ==========================================
+# 📅 本地日期 / 天數解析 (不經 LLM)
+# ==========================================
+class TemporalParser:
+    """
+    表格驅動的日期與天數解析器，規則全部在 class 載入時編譯好。
+    每個欄位附 confidence，低於 MIN_CONFIDENCE 的結果交回 LLM 判斷。
+    """
+
+    MIN_CONFIDENCE = 0.8
+    MAX_DURATION = 30
+
+    CN_DIGITS = {
+        "零": 0,
+        "〇": 0,
+        "一": 1,
+        "二": 2,
+        "兩": 2,
+        "三": 3,
+        "四": 4,
+        "五": 5,
+        "六": 6,
+        "七": 7,
+        "八": 8,
+        "九": 9,
+    }
+    CN_UNITS = {"十": 10, "百": 100}
+
+    RELATIVE_DAYS = {
+        "今天": 0,
+        "今日": 0,
+        "today": 0,
+        "明天": 1,
+        "明日": 1,
+        "tomorrow": 1,
+        "後天": 2,
+        "大後天": 3,
+    }
+    WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+    EN_WEEKDAYS = {
+        "mon": 0,
+        "tue": 1,
+        "wed": 2,
+        "thu": 3,
+        "fri": 4,
+        "sat": 5,
+        "sun": 6,
+    }
+    # 週的前綴 -> 往後幾週 (None = 沒講，取下一個出現的那天)
+    WEEK_OFFSETS = {
+        None: None,
+        "這": 0,
+        "這個": 0,
+        "本": 0,
+        "this": 0,
+        "下": 1,
+        "下個": 1,
+        "next": 1,
+        "下下": 2,
+        "下下個": 2,
+    }
+
+    _NUM = r"(\d+|[零〇一二兩三四五六七八九十百]+)"
+    _WEEK_PREFIX = r"(下下個|下下|下個|下|這個|這|本)?"
+    # 只列真正的星期名稱與縮寫，避免 sunny / wedding / fried 之類的字被誤判
+    _EN_DAY = (
+        r"(monday|mon|tuesday|tues?|wednesday|wed|thursday|thurs?|thu|"
+        r"friday|fri|saturday|sat|sunday|sun)"
+    )
+    # 數字前面不能是「第」或另一個數字，避免「第十二天」從「二」重新比對成 2 天
+    _NUM_START = r"(?<![第\d零〇一二兩三四五六七八九十百])"
+
+    # (規則名稱, 樣式, confidence)；名稱對應 _date_<name> / _dur_<name>
+    DATE_RULES = [
+        (
+            "ymd",
+            re.compile(r"(\d{4})\s*[年/\-.]\s*(\d{1,2})\s*[月/\-.]\s*(\d{1,2})\s*[日號]?"),
+            0.98,
+        ),
+        ("md", re.compile(_NUM + r"\s*月\s*" + _NUM + r"\s*[日號]"), 0.95),
+        ("md", re.compile(r"(?<![\d/])(\d{1,2})/(\d{1,2})(?![\d/])"), 0.9),
+        # 「三天後」是日期不是天數；要排在「後天」之前，才不會把「三天後天氣」拆錯
+        ("offset", re.compile(_NUM_START + _NUM + r"\s*天\s*[之以]?後"), 0.95),
+        (
+            "offset",
+            re.compile(r"(?<![a-z])in\s+(\d+)\s*days?(?![a-z])", re.IGNORECASE),
+            0.9,
+        ),
+        (
+            "offset",
+            re.compile(r"(\d+)\s*days?\s+(?:later|from\s+now)", re.IGNORECASE),
+            0.9,
+        ),
+        ("relative", re.compile(r"大後天|後天|今天|今日|明天|明日"), 0.98),
+        (
+            "relative",
+            re.compile(r"(?<![a-z])(today|tomorrow)(?![a-z])", re.IGNORECASE),
+            0.95,
+        ),
+        ("weekend", re.compile(_WEEK_PREFIX + r"(?:週末|周末)"), 0.9),
+        (
+            "weekday",
+            re.compile(_WEEK_PREFIX + r"(?:週|周|星期|禮拜)([一二三四五六日天])"),
+            0.9,
+        ),
+        (
+            "weekend",
+            re.compile(r"(?<![a-z])(?:(this|next)\s+)?weekend", re.IGNORECASE),
+            0.85,
+        ),
+        (
+            "weekday",
+            re.compile(
+                r"(?<![a-z])(?:(this|next)\s+)?" + _EN_DAY + r"(?![a-z])",
+                re.IGNORECASE,
+            ),
+            0.85,
+        ),
+    ]
+    DURATION_RULES = [
+        # 「3-5天」是範圍，要讓 LLM 或使用者決定，先佔住片段避免被當成 5 天
+        (
+            "range",
+            re.compile(_NUM_START + _NUM + r"\s*[-~～到至]\s*" + _NUM + r"\s*天"),
+            0.5,
+        ),
+        (
+            "range",
+            re.compile(r"(\d+)\s*(?:-|~|to)\s*(\d+)\s*days?(?![a-z])", re.IGNORECASE),
+            0.5,
+        ),
+        ("days", re.compile(_NUM_START + _NUM + r"\s*天\s*" + _NUM + r"\s*夜"), 0.98),
+        ("days", re.compile(_NUM_START + _NUM + r"\s*日遊"), 0.95),
+        ("days", re.compile(_NUM_START + _NUM + r"\s*天"), 0.95),
+        ("days", re.compile(r"(\d+)\s*days?(?![a-z])", re.IGNORECASE), 0.95),
+        (
+            "weeks",
+            re.compile(
+                _NUM_START + _NUM + r"\s*個?\s*(?:週|星期|禮拜)(?![一二三四五六日天末])"
+            ),
+            0.85,
+        ),
+        # 只講「兩夜」通常是 N+1 天，但也可能只算住宿，信心度刻意壓低
+        ("nights", re.compile(_NUM_START + _NUM + r"\s*夜"), 0.7),
+        ("nights", re.compile(r"(\d+)\s*nights?(?![a-z])", re.IGNORECASE), 0.7),
+    ]
+
+    # 迴歸語料：(訊息, 欄位, 期望值)
+    # 以 CORPUS_TODAY (週三) 為基準；期望值 None 代表應交給 LLM
+    CORPUS_TODAY = datetime.date(2025, 12, 24)
+    CORPUS = [
+        ("明天", "date", "2025-12-25"),
+        ("後天出發", "date", "2025-12-26"),
+        ("今天", "date", "2025-12-24"),
+        ("大後天", "date", "2025-12-27"),
+        ("tomorrow", "date", "2025-12-25"),
+        ("下週六", "date", "2026-01-03"),
+        ("下禮拜一出發", "date", "2025-12-29"),
+        ("這週六", "date", "2025-12-27"),
+        ("週六", "date", "2025-12-27"),
+        ("星期天", "date", "2025-12-28"),
+        ("這個週末", "date", "2025-12-27"),
+        ("下週末", "date", "2026-01-03"),
+        ("next Friday", "date", "2026-01-02"),
+        ("this friday", "date", "2025-12-26"),
+        ("12/25", "date", "2025-12-25"),
+        ("1/5", "date", "2026-01-05"),
+        ("12月31日", "date", "2025-12-31"),
+        ("一月三號", "date", "2026-01-03"),
+        ("十二月二十五日", "date", "2025-12-25"),
+        ("2026/2/14", "date", "2026-02-14"),
+        ("2026年3月1日", "date", "2026-03-01"),
+        ("這週一", "date", None),
+        ("明天或後天", "date", None),
+        ("12/25 或 12/26", "date", None),
+        ("過年的時候", "date", None),
+        ("2/30", "date", None),
+        ("3/5天", "date", "2026-03-05"),
+        ("三天後出發", "date", "2025-12-27"),
+        ("3天後", "date", "2025-12-27"),
+        ("兩天之後", "date", "2025-12-26"),
+        ("三天後天氣", "date", "2025-12-27"),
+        ("in 3 days", "date", "2025-12-27"),
+        ("weather in 3 days", "date", "2025-12-27"),
+        ("5 days later", "date", "2025-12-29"),
+        ("Will it be sunny in Tokyo?", "date", None),
+        ("weather for my wedding in Osaka", "date", None),
+        ("fried chicken trip to Tainan", "date", None),
+        ("monthly weather in Taipei", "date", None),
+        ("is the sun out in Kyoto", "date", None),
+        ("sunday", "date", "2025-12-28"),
+        ("next sat", "date", "2026-01-03"),
+        ("5天", "duration", 5),
+        ("三天兩夜", "duration", 3),
+        ("3天2夜", "duration", 3),
+        ("兩天一夜", "duration", 2),
+        ("十二天", "duration", 12),
+        ("二十天", "duration", 20),
+        ("一日遊", "duration", 1),
+        ("一週", "duration", 7),
+        ("3 days", "duration", 3),
+        ("兩夜", "duration", None),
+        ("第三天想去海邊", "duration", None),
+        ("週六天氣", "duration", None),
+        ("星期一天氣", "duration", None),
+        ("下週六天氣好的話去台南", "duration", None),
+        ("3/5天", "duration", None),
+        ("三天後出發", "duration", None),
+        ("3天後", "duration", None),
+        ("in 3 days", "duration", None),
+        ("weather in 3 days", "duration", None),
+        ("第十二天", "duration", None),
+        ("第12天", "duration", None),
+        ("第二十天", "duration", None),
+        ("3-5天", "duration", None),
+        ("3到5天", "duration", None),
+        ("3-5 days", "duration", None),
+        ("看情況", "duration", None),
+    ]
+
+    @classmethod
+    def parse(cls, msg: str, today: datetime.date = None) -> dict:
+        """
+        回傳 {"date": "YYYY-MM-DD", "duration": int, "confidence": {...}}，
+        解析不到的欄位不會出現。
+        """
+        today = today or datetime.date.today()
+        result = {"confidence": {}}
+
+        # 日期規則先跑，佔住的片段天數規則不能再用 (避免「週六天氣」被讀成 6 天)
+        taken = []
+        dates = cls._collect(msg, cls.DATE_RULES, "_date_", today, taken)
+        if dates:
+            value, conf = cls._pick(dates)
+            result["date"] = value.strftime("%Y-%m-%d")
+            result["confidence"]["date"] = conf
+
+        durations = cls._collect(msg, cls.DURATION_RULES, "_dur_", today, taken)
+        durations = [(v, c) for v, c in durations if 0 < v < cls.MAX_DURATION]
+        if durations:
+            value, conf = cls._pick(durations)
+            result["duration"] = value
+            result["confidence"]["duration"] = conf
+
+        return result
+
+    @classmethod
+    def _collect(cls, msg, rules, prefix, today, taken: list) -> list:
+        """
+        依序套用規則；和已佔用片段重疊的比對 (例如 2025/12/25 裡的 12/25) 跳過。
+        新比對到的片段會加進 taken。
+        """
+        found = []
+        for name, pattern, conf in rules:
+            handler = getattr(cls, prefix + name)
+            for m in pattern.finditer(msg):
+                if any(m.start() < end and start < m.end() for start, end in taken):
+                    continue
+                taken.append(m.span())
+                try:
+                    parsed = handler(m, today)
+                except ValueError:
+                    continue
+                if parsed is not None:
+                    value, penalty = parsed
+                    found.append((value, min(conf, penalty)))
+        return found
+
+    @staticmethod
+    def _pick(candidates: list):
+        """取信心度最高的候選；出現多個不同的值時視為模糊"""
+        value, conf = max(candidates, key=lambda c: c[1])
+        if len({v for v, _ in candidates}) > 1:
+            conf = min(conf, 0.5)
+        return value, conf
+
+    @classmethod
+    def to_int(cls, token: str) -> int:
+        """'12' / '十二' / '二十五' / '一百' / '二〇二五' -> int"""
+        if token.isdigit():
+            return int(token)
+        if not any(ch in cls.CN_UNITS for ch in token):
+            return int("".join(str(cls.CN_DIGITS[ch]) for ch in token))
+        total, current = 0, 0
+        for ch in token:
+            if ch in cls.CN_UNITS:
+                total += (current or 1) * cls.CN_UNITS[ch]
+                current = 0
+            else:
+                current = cls.CN_DIGITS[ch]
+        return total + current
+
+    # ---------- 日期規則 ----------
+    @classmethod
+    def _date_ymd(cls, m, today):
+        year, month, day = (int(g) for g in m.groups())
+        return datetime.date(year, month, day), 1.0
+
+    @classmethod
+    def _date_md(cls, m, today):
+        month, day = cls.to_int(m.group(1)), cls.to_int(m.group(2))
+        target = datetime.date(today.year, month, day)
+        # 沒寫年份又已經過了 -> 明年
+        if target < today:
+            target = datetime.date(today.year + 1, month, day)
+        return target, 1.0
+
+    @classmethod
+    def _date_offset(cls, m, today):
+        return today + datetime.timedelta(days=cls.to_int(m.group(1))), 1.0
+
+    @classmethod
+    def _date_relative(cls, m, today):
+        offset = cls.RELATIVE_DAYS[m.group(0).lower()]
+        return today + datetime.timedelta(days=offset), 1.0
+
+    @classmethod
+    def _date_weekday(cls, m, today):
+        prefix, day = m.group(1), m.group(2)
+        weekday = cls.WEEKDAYS.get(day)
+        if weekday is not None:
+            return cls._resolve_week(prefix, weekday, today)
+        day = day.lower()
+        target, conf = cls._resolve_week(prefix, cls.EN_WEEKDAYS[day[:3]], today)
+        # 單獨的 sun / sat / wed 常常只是一般英文字，沒有 this/next 就交給 LLM
+        if not prefix and not day.endswith("day"):
+            conf = min(conf, 0.6)
+        return target, conf
+
+    @classmethod
+    def _date_weekend(cls, m, today):
+        return cls._resolve_week(m.group(1), 5, today)
+
+    @classmethod
+    def _resolve_week(cls, prefix, weekday, today):
+        weeks = cls.WEEK_OFFSETS[prefix.lower() if prefix else None]
+        if weeks is None:
+            # 沒講哪一週：取下一個 (含今天) 出現的那天
+            return today + datetime.timedelta(days=(weekday - today.weekday()) % 7), 1.0
+        monday = today - datetime.timedelta(days=today.weekday())
+        target = monday + datetime.timedelta(weeks=weeks, days=weekday)
+        # 「這週一」但今天已經週三：大概是講錯，交給 LLM
+        return target, (0.6 if target < today else 1.0)
+
+    # ---------- 天數規則 ----------
+    @classmethod
+    def _dur_days(cls, m, today):
+        return cls.to_int(m.group(1)), 1.0
+
+    @classmethod
+    def _dur_range(cls, m, today):
+        return cls.to_int(m.group(2)), 1.0
+
+    @classmethod
+    def _dur_weeks(cls, m, today):
+        return cls.to_int(m.group(1)) * 7, 1.0
+
+    @classmethod
+    def _dur_nights(cls, m, today):
+        return cls.to_int(m.group(1)) + 1, 1.0
+
+    @staticmethod
+    def _legacy_parse(msg: str, today: datetime.date) -> dict:
+        """v9.0 的關鍵字解析 (原 Tools.try_local_parse)，只留給 evaluate() 當比較基準"""
+        result = {}
+        msg_clean = msg.replace(" ", "")
+
+        if "明天" in msg_clean:
+            result["date"] = (today + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        elif "後天" in msg_clean:
+            result["date"] = (today + datetime.timedelta(days=2)).strftime("%Y-%m-%d")
+        elif "今天" in msg_clean:
+            result["date"] = today.strftime("%Y-%m-%d")
+
+        digit_match = re.search(r"(\d+)\s*天", msg_clean)
+        if digit_match:
+            val = int(digit_match.group(1))
+            if val < 30:
+                result["duration"] = val
+
+        cn_map = {
+            "一": 1,
+            "二": 2,
+            "兩": 2,
+            "三": 3,
+            "四": 4,
+            "五": 5,
+            "六": 6,
+            "七": 7,
+            "八": 8,
+            "九": 9,
+            "十": 10,
+        }
+        for k, v in cn_map.items():
+            if (k + "天") in msg_clean:
+                result["duration"] = v
+                break
+
+        return result
+
+    @classmethod
+    def evaluate(cls, corpus: list = None, today: datetime.date = None) -> dict:
+        """
+        用迴歸語料衡量本地解析省下多少次 LLM 呼叫：
+        在 collecting_date / collecting_duration 狀態，欄位被本地解析就不必呼叫 LLM。
+        """
+        corpus = cls.CORPUS if corpus is None else corpus
+        today = today or cls.CORPUS_TODAY
+        saved, legacy_saved, failures = 0, 0, []
+        for msg, field, expected in corpus:
+            got = Tools.try_local_parse(msg, today=today).get(field)
+            if got is not None and got == expected:
+                saved += 1
+            # 舊版解析器實際跑一次，答對且有值才算省下一次呼叫
+            legacy = cls._legacy_parse(msg, today).get(field)
+            if legacy is not None and legacy == expected:
+                legacy_saved += 1
+            if got != expected:
+                failures.append(
+                    {"msg": msg, "field": field, "expected": expected, "got": got}
+                )
+        return {
+            "total": len(corpus),
+            "llm_calls_saved": saved,
+            "legacy_llm_calls_saved": legacy_saved,
+            "failures": failures,
+        }
+
+
 # ==========================================
 # 🧱 基礎建設
 # ==========================================
@@ -260,49 +995,16 @@ class Tools:
         return "TRASH"
 
     @staticmethod
-    def try_local_parse(msg: str) -> dict:
+    def try_local_parse(msg: str, today: datetime.date = None) -> dict:
         """
-        ⚡ 光速解析 - 嚴格版
+        ⚡ 光速解析 - 只回傳信心度夠高的欄位，其餘交給 LLM
         """
+        parsed = TemporalParser.parse(msg, today)
         result = {}
-        msg_clean = msg.replace(" ", "")
-
-        today = datetime.datetime.now()
-        if "明天" in msg_clean:
-            result["date"] = (today + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-        elif "後天" in msg_clean:
-            result["date"] = (today + datetime.timedelta(days=2)).strftime("%Y-%m-%d")
-        elif "今天" in msg_clean:
-            result["date"] = today.strftime("%Y-%m-%d")
-
-        # 2. 解析天數 (嚴格限制：必須有 '天')
-        digit_match = re.search(r"(\d+)\s*天", msg_clean)
-        if digit_match:
-            try:
-                val = int(digit_match.group(1))
-                if val < 30:
-                    result["duration"] = val
-            except:
-                pass
-
-        cn_map = {
-            "一": 1,
-            "二": 2,
-            "兩": 2,
-            "三": 3,
-            "四": 4,
-            "五": 5,
-            "六": 6,
-            "七": 7,
-            "八": 8,
-            "九": 9,
-            "十": 10,
-        }
-        for k, v in cn_map.items():
-            if (k + "天") in msg_clean:
-                result["duration"] = v
-                break
-
+        for field in ("date", "duration"):
+            conf = parsed["confidence"].get(field, 0.0)
+            if conf >= TemporalParser.MIN_CONFIDENCE:
+                result[field] = parsed[field]
         return result
 
     @staticmethod
@@ -354,14 +1056,21 @@ class Tools:
             f"JSON:"
         )
         res = Tools._call_block(prompt).strip()
+        # 城市還是得靠 LLM，但日期以本地解析為準 (LLM 常算錯星期/跨年)
+        local_date = Tools.try_local_parse(msg).get("date")
+        if local_date == today:
+            local_date = "today"
         try:
             start = res.find("{")
             end = res.rfind("}") + 1
             if start != -1 and end != -1:
-                return json.loads(res[start:end])
+                info = json.loads(res[start:end])
+                if local_date:
+                    info["date"] = local_date
+                return info
         except:
             pass
-        return {"city": None, "date": "today"}
+        return {"city": None, "date": local_date or "today"}
 
     @staticmethod
     def get_weather(city: str, target_date: str = "today") -> str:
@@ -551,10 +1260,13 @@ class ZoneTravel(StateMachine):
             p2 = f"請規劃 {dest} {day_label} 的『午餐與下午』行程。推薦特色午餐與午後景點。請用繁體中文。{weather_note}"
             p3 = f"請規劃 {dest} {day_label} 的『晚餐與晚上』行程。推薦夜市或夜景。請用繁體中文。{weather_note}"
 
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                f1 = executor.submit(Tools._call_block, p1)
-                f2 = executor.submit(Tools._call_block, p2)
-                f3 = executor.submit(Tools._call_block, p3)
+            call_block = PipeProfiler.bind(Tools._call_block)
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=3, thread_name_prefix="toc_plan"
+            ) as executor:
+                f1 = executor.submit(call_block, p1)
+                f2 = executor.submit(call_block, p2)
+                f3 = executor.submit(call_block, p3)
 
                 yield f"### 🌅 {day_label} 上午"
                 yield from wait_with_heartbeat(f1)
@@ -573,14 +1285,48 @@ class ZoneTravel(StateMachine):
 # ==========================================
 class Pipe:
     class Valves(BaseModel):
-        pass
+        # 🔬 剖析：取樣多少比例的 pipe 呼叫 (0 = 關閉, 1 = 全部)
+        PROFILE_SAMPLE_RATE: float = 0.0
+        PROFILE_INTERVAL_MS: float = 5.0
+        PROFILE_DIR: str = "./toc_profiles"
+        PROFILE_MAX_BYTES: int = 50 * 1024 * 1024
+        # 📦 輸出合併：累積到 N bytes 或等待 M ms 就送出一個 frame
+        COALESCE_ENABLED: bool = True
+        COALESCE_MAX_BYTES: int = 512
+        COALESCE_MAX_LATENCY_MS: float = 100.0
+        COALESCE_HEARTBEAT_LATENCY_MS: float = 2000.0
+        COALESCE_LOG_STATS: bool = False
 
     def __init__(self):
         self.type = "manifold"
         self.id = "toc_agent"
         self.name = "TOC Agent (Triple Key)"
+        self.valves = self.Valves()
 
     def pipe(self, body: dict) -> Union[str, Generator, Iterator]:
+        gen = self._run(body)
+
+        rate = self.valves.PROFILE_SAMPLE_RATE
+        if rate > 0 and random.random() < rate:
+            profiler = PipeProfiler(
+                out_dir=self.valves.PROFILE_DIR,
+                interval_ms=self.valves.PROFILE_INTERVAL_MS,
+                max_bytes=self.valves.PROFILE_MAX_BYTES,
+                tag=str(body.get("user", {}).get("id", "default_user")),
+            )
+            gen = profiler.profile(gen)
+
+        if self.valves.COALESCE_ENABLED:
+            coalescer = FrameCoalescer(
+                max_bytes=self.valves.COALESCE_MAX_BYTES,
+                max_latency_ms=self.valves.COALESCE_MAX_LATENCY_MS,
+                heartbeat_latency_ms=self.valves.COALESCE_HEARTBEAT_LATENCY_MS,
+                log_stats=self.valves.COALESCE_LOG_STATS,
+            )
+            gen = coalescer.coalesce(gen)
+        return gen
+
+    def _run(self, body: dict) -> Generator[str, None, None]:
         try:
             msg = body.get("messages", [])[-1].get("content", "").strip()
             user_id = body.get("user", {}).get("id", "default_user")
@@ -701,4 +1447,11 @@ class Pipe:
                 yield from Tools._call_smart(f"User: {msg}\nReply:")
 
         except Exception as e:
-            yield f"⚠️ Error: {e}"
\ No newline at end of file
+            yield f"⚠️ Error: {e}"
+
+
+if __name__ == "__main__":
+    # python toc_agent.py：跑日期/天數解析的迴歸語料，有錯就以非 0 結束
+    report = TemporalParser.evaluate()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if report["failures"] else 0)